@@ -1,14 +1,127 @@
-from flask import Flask, request, jsonify
+import logging
+import os
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from functools import lru_cache
+from threading import Lock
+
+from cachetools import TTLCache
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import JSONProvider
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from flask_cors import CORS
 
+# Log level comes from the LOG_LEVEL env var, set it to DEBUG to log request payloads
+    # An unknown level falls back to INFO rather than stopping the app from starting
+log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
+log_level_valid = isinstance(logging.getLevelName(log_level), int)
+logging.basicConfig(level=log_level if log_level_valid else logging.INFO)
+logger = logging.getLogger(__name__)
+if not log_level_valid:
+    logger.warning("Unknown LOG_LEVEL %r, using INFO", log_level)
+
+class ORJSONProvider(JSONProvider):
+    """
+    Flask JSON provider backed by orjson.
+
+    Used for both request.get_json() and jsonify.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 # Initialize the Flask app
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 CORS(app)
 
 # AniList GraphQL API endpoint
 url = 'https://graphql.anilist.co'
 
+# Shared HTTP session so AniList requests reuse keep-alive connections
+    # The adapter only retries failed connections, which never reach AniList
+    # Rate limit and server error responses are retried in post_anilist so every attempt goes through the rate limiter
+session = requests.Session()
+session.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=3, read=0, backoff_factor=0.3),
+))
+session.headers.update({'Content-Type': 'application/json'})
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+
+    Allows up to `rate` calls per `per` seconds, with bursts of up to `burst` calls.
+    """
+
+    def __init__(self, rate, per, burst):
+        self.fill_rate = rate / per
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = Lock()
+
+    def acquire(self, timeout):
+        """
+        Takes a token, sleeping until one is available.
+
+        Returns True once a token is taken, or False straight away if none will be available within `timeout` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+
+                wait = (1 - self.tokens) / self.fill_rate
+
+            if now + wait > deadline:
+                return False
+
+            time.sleep(wait)
+
+    def drain(self):
+        """
+        Empties the bucket, so further calls are spaced out at the fill rate with no burst.
+        """
+        with self.lock:
+            self.tokens = 0
+            self.updated = time.monotonic()
+
+
+# Number of worker processes sharing the AniList rate limit, set by the on_starting hook in gunicorn.conf.py
+WORKER_COUNT = max(1, int(os.getenv('WEB_CONCURRENCY', '1')))
+
+# Limit on outbound AniList requests from this process
+    # AniList allows 90 requests per minute, so the service as a whole aims for 80 and each worker gets an equal share
+    # Requests over the limit are queued here for up to ANILIST_MAX_QUEUE_WAIT instead of getting 429s
+anilist_rate_limiter = TokenBucket(rate=80 / WORKER_COUNT, per=60, burst=max(1, 10 // WORKER_COUNT))
+
+# Cache of successful AniList responses, keyed by query name and variables
+    # Anime metadata changes on the order of hours, so repeat searches within 10 minutes are served from memory
+    # Entries are raw response bytes and a search page can be hundreds of KB, so the cache is sized in bytes per worker
+ANILIST_CACHE_BYTES = 32 * 1024 * 1024
+anilist_cache = TTLCache(maxsize=ANILIST_CACHE_BYTES, ttl=600, getsizeof=len)
+anilist_cache_lock = Lock()
+
+# AniList requests currently in flight, keyed like the cache, as (Future, deadline) pairs
+    # Concurrent identical requests wait on the first one's Future until its deadline instead of calling AniList again
+anilist_inflight = {}
+
 # Define the GraphQL query
     # We are searching for an anime by its title
 query = '''
@@ -40,6 +153,169 @@ query ($search: String) {
 }
 '''
 
+# Socket timeout for AniList requests, in seconds
+    # This bounds connecting and each wait for response data, not the whole request
+ANILIST_TIMEOUT = 10
+
+# Total time budget for one AniList fetch, in seconds
+    # Covers the rate limiter wait, every attempt and the backoff between them, and is shared with callers waiting on the same fetch
+ANILIST_DEADLINE = 15
+
+# AniList responses worth retrying, and how many times
+ANILIST_RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+ANILIST_MAX_RETRIES = 3
+
+# Longest backoff before a retry, in seconds
+    # AniList asks for about a minute on a 429, which is too long to hold a request open, so give up instead
+ANILIST_MAX_RETRY_WAIT = 5
+
+# When AniList reports this many requests or fewer left in its window, stop bursting and space requests out
+ANILIST_LOW_REMAINING = 10
+
+# Longest time a request waits in the rate limiter, in seconds
+    # Past this the request fails with the usual error rather than holding the client connection open
+ANILIST_MAX_QUEUE_WAIT = 2
+
+# Longest search title accepted by the '/api' route
+MAX_TITLE_LENGTH = 100
+
+
+@lru_cache(maxsize=None)
+def encode_query_prefix(graphql_query):
+    """
+    Encodes the invariant part of the request body for a GraphQL query.
+
+    Returns the JSON bytes for {"query": ...} without the closing brace, so the variables can be appended per request.
+    """
+    return orjson.dumps({'query': graphql_query})[:-1]
+
+
+def post_anilist(graphql_query, variables, deadline):
+    """
+    Sends a GraphQL query to the AniList API using the shared session.
+
+    All AniList requests should go through here so they share the same connection pool, timeout and rate limit.
+
+    Rate limit and server error responses are retried with backoff, unless AniList asks to wait longer than ANILIST_MAX_RETRY_WAIT or the retry would pass `deadline`.
+
+    `deadline` is a time.monotonic() value that bounds the whole call, including waits for the rate limit.
+
+    Returns the requests Response object. Raises requests.Timeout if the deadline passes, or the rate limit would delay the request too long.
+    """
+    # Only the variables are encoded per request, the query part is encoded once
+    body = encode_query_prefix(graphql_query) + b',"variables":' + orjson.dumps(variables) + b'}'
+
+    for attempt in range(ANILIST_MAX_RETRIES + 1):
+        # Every attempt, including retries, counts against the rate limit
+        queue_wait = min(ANILIST_MAX_QUEUE_WAIT, deadline - time.monotonic())
+        if not anilist_rate_limiter.acquire(timeout=queue_wait):
+            raise requests.Timeout("Timed out waiting for the AniList rate limit")
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise requests.Timeout("AniList request deadline passed")
+
+        response = session.post(url, data=body, timeout=min(ANILIST_TIMEOUT, remaining))
+        check_rate_limit_headers(response)
+
+        if response.status_code not in ANILIST_RETRY_STATUSES or attempt == ANILIST_MAX_RETRIES:
+            return response
+
+        wait = retry_wait(response, attempt)
+        if wait is None or wait > ANILIST_MAX_RETRY_WAIT or time.monotonic() + wait >= deadline:
+            return response
+
+        time.sleep(wait)
+
+
+def check_rate_limit_headers(response):
+    """
+    Slows the rate limiter down when AniList says its rate limit is nearly used up.
+
+    AniList counts requests from all workers together, so this catches what the per-worker share of the limit misses.
+    """
+    if response.status_code == 429:
+        anilist_rate_limiter.drain()
+        return
+
+    try:
+        remaining = int(response.headers.get('X-RateLimit-Remaining', ''))
+    except ValueError:
+        return
+
+    if remaining <= ANILIST_LOW_REMAINING:
+        anilist_rate_limiter.drain()
+
+
+def retry_wait(response, attempt):
+    """
+    Works out how long to wait before retrying a failed AniList request.
+
+    Uses the Retry-After header when AniList sends one, otherwise exponential backoff for server errors.
+
+    Returns the wait in seconds, or None if the request should not be retried.
+    """
+    retry_after = response.headers.get('Retry-After')
+    if retry_after is None:
+        # AniList's rate limit window is about a minute, so a 429 without Retry-After will not clear within a short backoff
+        if response.status_code == 429:
+            return None
+        return 0.3 * 2 ** attempt
+
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        return None
+
+
+def fetch_anilist(cache_key, graphql_query, variables):
+    """
+    Fetches a GraphQL query from AniList, going through the response cache.
+
+    On a cache miss only one request per cache_key is sent at a time; concurrent callers with the same key wait for that request and share its result.
+
+    The request and its waiters share one deadline, ANILIST_DEADLINE seconds after the request started.
+
+    Returns the raw JSON body as bytes, or None if the request failed.
+    """
+    with anilist_cache_lock:
+        cached = anilist_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        inflight = anilist_inflight.get(cache_key)
+        is_leader = inflight is None
+        if is_leader:
+            inflight = anilist_inflight[cache_key] = (Future(), time.monotonic() + ANILIST_DEADLINE)
+
+    future, deadline = inflight
+
+    # Another request is already fetching this key, wait for its result until the same deadline it is working to
+    if not is_leader:
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            return None
+
+    content = None
+    try:
+        response = post_anilist(graphql_query, variables, deadline)
+        if response.status_code == 200:
+            content = response.content
+    except requests.RequestException:
+        # Treat timeouts and connection errors the same as a failed response
+        pass
+    finally:
+        with anilist_cache_lock:
+            # TTLCache refuses values bigger than the whole cache
+            if content is not None and len(content) <= ANILIST_CACHE_BYTES:
+                anilist_cache[cache_key] = content
+            del anilist_inflight[cache_key]
+        future.set_result(content)
+
+    return content
+
+
 # Flask route to handle the POST request
 @app.route('/api', methods=['POST'])
 def get_anime():
@@ -48,7 +324,7 @@ def get_anime():
 
     It gets the anime title from the request JSON data and uses it to make a query to the AniList GraphQL API.
 
-    The response from the API is returned as a JSON response.
+    The response from the API is passed straight through as a JSON response.
 
     If the request fails, an error message is returned.
 
@@ -60,26 +336,36 @@ def get_anime():
     """
 
     data = request.get_json()
-    print(data)
+    logger.debug("Received search request: %s", data)
+
+    anime_name = data.get('title') if isinstance(data, dict) else None
 
-    anime_name = data.get('title')
+    # Reject missing or malformed titles without calling AniList
+    if not isinstance(anime_name, str):
+        return jsonify({"error": "Invalid anime title"}), 400
 
+    # Strip once so "Naruto " and "Naruto" share a search and a cache entry
+    anime_name = anime_name.strip()
+    if not anime_name or len(anime_name) > MAX_TITLE_LENGTH:
+        return jsonify({"error": "Invalid anime title"}), 400
 
     # Define our query variables and values that will be used in the query request
     variables = {
         'search': anime_name
     }
 
-    # Make the HTTP API request using requests.post
-    response = requests.post(url, json={'query': query, 'variables': variables})
+    # Make the HTTP API request, served from the cache for repeat searches
+    content = fetch_anilist(('search', anime_name), query, variables)
 
-    # Check if the response is successful
-    if response.status_code == 200:
-        # Return the response as JSON
-        return jsonify(response.json())
+    # Check if the request was successful
+    if content is not None:
+        # Return the AniList JSON body as is, without decoding and re-encoding it
+        return Response(content, status=200, mimetype='application/json')
     else:
         # Return an error message
         return jsonify({"error": "Failed to get list of anime"}), 400
 
+# Flask's development server, for local use only
+    # In production run under gunicorn instead (see gunicorn.conf.py): gunicorn api_main:app
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,25 @@
+# Gunicorn config for running the API in production
+    # Run with: gunicorn api_main:app
+    # The gevent worker monkey-patches sockets, so requests to AniList yield to other requests instead of blocking the worker
+import os
+
+bind = '0.0.0.0:8000'
+
+# Each gevent worker already handles many requests at once, and every worker gets an equal share of the AniList rate limit
+    # so keep the worker count low to avoid splitting the limit into shares too small to absorb a burst
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+worker_class = 'gevent'
+worker_connections = 1000
+keepalive = 5
+
+# Request logs go to stdout, so the app itself does not need to log each request
+accesslog = '-'
+
+
+def on_starting(server):
+    """
+    Exports the resolved worker count, including any -w override on the command line, as WEB_CONCURRENCY.
+
+    Workers are forked from the master, so they inherit it and the app can split the AniList rate limit between them.
+    """
+    os.environ['WEB_CONCURRENCY'] = str(server.cfg.workers)
@@ -0,0 +1,231 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+import requests
+
+import api_main
+
+
+def make_response(status_code, content=b'{"data":{"Page":{"media":[]}}}', headers=None):
+    """
+    Builds a requests Response as AniList would return it.
+    """
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content
+    response.headers.update(headers or {})
+    return response
+
+
+class StubSession:
+    """
+    Stands in for session.post, returning queued responses and recording each call.
+
+    Each call takes `delay` seconds, or raises requests.Timeout if the timeout passed in is shorter.
+    """
+
+    def __init__(self, responses, delay=0):
+        self.responses = list(responses)
+        self.delay = delay
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def post(self, url, data=None, timeout=None):
+        with self.lock:
+            self.calls += 1
+        if timeout is not None and self.delay > timeout:
+            time.sleep(timeout)
+            raise requests.Timeout()
+        time.sleep(self.delay)
+        with self.lock:
+            return self.responses.pop(0)
+
+
+class AniListTestCase(unittest.TestCase):
+    """
+    Resets the module-level cache, in-flight map and rate limiter around each test.
+    """
+
+    def setUp(self):
+        api_main.anilist_cache.clear()
+        api_main.anilist_inflight.clear()
+
+        limiter = mock.patch.object(api_main, 'anilist_rate_limiter', api_main.TokenBucket(rate=6000, per=60, burst=100))
+        limiter.start()
+        self.addCleanup(limiter.stop)
+
+        self.client = api_main.app.test_client()
+
+    def stub_session(self, responses, delay=0):
+        stub = StubSession(responses, delay)
+        patcher = mock.patch.object(api_main.session, 'post', stub.post)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return stub
+
+    def search(self, title):
+        return self.client.post('/api', json={'title': title})
+
+    def concurrent_searches(self, title, count):
+        """
+        Starts `count` searches for the same title a moment apart and returns their status codes.
+        """
+        statuses = []
+        threads = [threading.Thread(target=lambda: statuses.append(self.search(title).status_code)) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.02)
+        for thread in threads:
+            thread.join()
+        return sorted(statuses)
+
+
+class FetchAniListTests(AniListTestCase):
+
+    def test_concurrent_identical_searches_make_one_request(self):
+        stub = self.stub_session([make_response(200)], delay=0.2)
+
+        self.assertEqual(self.concurrent_searches('Naruto', 5), [200] * 5)
+        self.assertEqual(stub.calls, 1)
+
+    def test_repeat_search_is_served_from_cache(self):
+        stub = self.stub_session([make_response(200)])
+
+        first = self.search('Naruto')
+        second = self.search('Naruto')
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.get_data(), first.get_data())
+        self.assertEqual(stub.calls, 1)
+
+    def test_failed_search_is_not_cached(self):
+        stub = self.stub_session([make_response(404), make_response(200)])
+
+        self.assertEqual(self.search('Naruto').status_code, 400)
+        self.assertEqual(self.search('Naruto').status_code, 200)
+        self.assertEqual(stub.calls, 2)
+
+    def test_waiters_share_result_of_retried_fetch(self):
+        stub = self.stub_session([make_response(503), make_response(503), make_response(200)], delay=0.2)
+
+        self.assertEqual(self.concurrent_searches('Naruto', 3), [200] * 3)
+        self.assertEqual(stub.calls, 3)
+
+    def test_leader_and_waiters_give_up_at_shared_deadline(self):
+        self.stub_session([make_response(200)], delay=5)
+
+        with mock.patch.object(api_main, 'ANILIST_DEADLINE', 0.3):
+            start = time.monotonic()
+            statuses = self.concurrent_searches('Naruto', 3)
+            elapsed = time.monotonic() - start
+
+        self.assertEqual(statuses, [400] * 3)
+        self.assertLess(elapsed, 1)
+        self.assertEqual(api_main.anilist_inflight, {})
+
+
+class TokenBucketTests(unittest.TestCase):
+
+    def test_burst_then_paced_at_fill_rate(self):
+        bucket = api_main.TokenBucket(rate=600, per=60, burst=3)
+
+        start = time.monotonic()
+        results = [bucket.acquire(timeout=1) for _ in range(5)]
+        elapsed = time.monotonic() - start
+
+        self.assertEqual(results, [True] * 5)
+        self.assertAlmostEqual(elapsed, 0.2, delta=0.08)
+
+    def test_gives_up_without_waiting_when_timeout_is_too_short(self):
+        bucket = api_main.TokenBucket(rate=6, per=60, burst=1)
+        bucket.acquire(timeout=0)
+
+        start = time.monotonic()
+        self.assertFalse(bucket.acquire(timeout=1))
+        self.assertLess(time.monotonic() - start, 0.05)
+
+    def test_drain_removes_the_burst(self):
+        bucket = api_main.TokenBucket(rate=600, per=60, burst=5)
+        bucket.drain()
+
+        self.assertFalse(bucket.acquire(timeout=0))
+        self.assertTrue(bucket.acquire(timeout=0.2))
+
+
+class PostAniListTests(AniListTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tokens_taken = 0
+        acquire = api_main.anilist_rate_limiter.acquire
+
+        def counting_acquire(timeout):
+            self.tokens_taken += 1
+            return acquire(timeout)
+
+        patcher = mock.patch.object(api_main.anilist_rate_limiter, 'acquire', counting_acquire)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self):
+        return api_main.post_anilist(api_main.query, {'search': 'Naruto'}, time.monotonic() + api_main.ANILIST_DEADLINE)
+
+    def test_server_errors_are_retried_and_each_attempt_takes_a_token(self):
+        stub = self.stub_session([make_response(500), make_response(502), make_response(200)])
+
+        self.assertEqual(self.post().status_code, 200)
+        self.assertEqual(stub.calls, 3)
+        self.assertEqual(self.tokens_taken, 3)
+
+    def test_retries_stop_after_max_retries(self):
+        stub = self.stub_session([make_response(503)] * (api_main.ANILIST_MAX_RETRIES + 1))
+
+        with mock.patch.object(api_main, 'retry_wait', return_value=0):
+            self.assertEqual(self.post().status_code, 503)
+        self.assertEqual(stub.calls, api_main.ANILIST_MAX_RETRIES + 1)
+
+    def test_short_retry_after_is_honoured(self):
+        stub = self.stub_session([make_response(429, headers={'Retry-After': '0.2'}), make_response(200)])
+
+        start = time.monotonic()
+        self.assertEqual(self.post().status_code, 200)
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        self.assertEqual(stub.calls, 2)
+
+    def test_long_retry_after_fails_fast(self):
+        stub = self.stub_session([make_response(429, headers={'Retry-After': '60'}), make_response(200)])
+
+        start = time.monotonic()
+        self.assertEqual(self.post().status_code, 429)
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertEqual(stub.calls, 1)
+
+    def test_429_without_retry_after_is_not_retried(self):
+        stub = self.stub_session([make_response(429), make_response(200)])
+
+        self.assertEqual(self.post().status_code, 429)
+        self.assertEqual(stub.calls, 1)
+
+    def test_low_rate_limit_remaining_drains_the_bucket(self):
+        self.stub_session([make_response(200, headers={'X-RateLimit-Remaining': '3'})])
+
+        self.post()
+        self.assertFalse(api_main.anilist_rate_limiter.acquire(timeout=0))
+
+    def test_search_fails_when_rate_limit_queue_is_too_long(self):
+        stub = self.stub_session([make_response(200)] * 2)
+
+        with mock.patch.object(api_main, 'anilist_rate_limiter', api_main.TokenBucket(rate=6, per=60, burst=1)):
+            self.assertEqual(self.search('Naruto').status_code, 200)
+
+            start = time.monotonic()
+            self.assertEqual(self.search('Bleach').status_code, 400)
+            self.assertLess(time.monotonic() - start, 0.1)
+
+        self.assertEqual(stub.calls, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()